@@ -15,16 +15,27 @@ Date: 3/5/2025
 """
 
 import os
+import json
 import time
 import random
-import re
+import asyncio
+import tempfile
+import zipfile
+import zlib
+import contextlib
+import aiohttp
+import re2
 import requests
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
+from email.utils import formatdate
+from typing import Dict, Optional, Set
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 
 from constants import API_KEY, USER_AGENT  # Replace with your API Key and User Agent
+from sec_session import REQUEST_TIMEOUT, make_session
 from sec_api import QueryApi
 
 # === Configuration Constants === #
@@ -36,6 +47,15 @@ QUERY_STRING = (
     'formType:("10-K","10-KT","10KSB","10KT405","10KSB40","10-K405") '
     'AND filedAt:[2023-01-01 TO 2023-12-31]'
 )
+SEC_MAX_REQUESTS_PER_SECOND = 10  # SEC fair-access limit
+DOCUMENT_CONCURRENCY = 8
+MAX_RETRIES = 5
+SUBMISSIONS_CACHE_DIR = os.path.join(".cache", "submissions")
+SUBMISSIONS_CACHE_MAX_AGE = 7 * 24 * 3600  # seconds before a cached submission is revalidated
+BULK_SUBMISSIONS_URL = "https://www.sec.gov/Archives/edgar/daily-index/bulkdata/submissions.zip"
+BULK_SUBMISSIONS_THRESHOLD = 50  # above this many uncached CIKs, use the bulk archive
+
+SESSION = make_session()  # pooled session for synchronous requests
 
 # === Utility Functions === #
 def set_working_directory(path: str) -> None:
@@ -92,57 +112,200 @@ def query_filings(api: QueryApi, query_str: str, desired_count: int, page_size:
     print("Total 10-K filings in DataFrame:", len(filings_df))
     return filings_df
 
-def get_submission_data(cik: int) -> dict:
+def _submission_cache_path(cik: int) -> str:
+    """Path of the on-disk cache file for a CIK's submissions JSON."""
+    return os.path.join(SUBMISSIONS_CACHE_DIR, f"CIK{str(cik).zfill(10)}.json")
+
+def _read_cached_submission(cik: int, max_age: Optional[float] = SUBMISSIONS_CACHE_MAX_AGE) -> Optional[dict]:
+    """
+    Load a CIK's submissions JSON from the disk cache.
+
+    Args:
+        cik (int): The company's CIK.
+        max_age (float): Maximum age of the cache file in seconds, or None for any age.
+
+    Returns:
+        The cached submission data, or None if missing, stale, or unreadable.
+    """
+    path = _submission_cache_path(cik)
+    if not os.path.exists(path):
+        return None
+    if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_cached_submission(cik: int, body: str) -> None:
+    """Store a CIK's raw submissions JSON in the disk cache."""
+    os.makedirs(SUBMISSIONS_CACHE_DIR, exist_ok=True)
+    with open(_submission_cache_path(cik), "w", encoding="utf-8") as f:
+        f.write(body)
+
+@contextlib.asynccontextmanager
+async def _rate_limited(sem: asyncio.Semaphore):
+    """
+    Hold a semaphore slot for at least one second per request.
+
+    With at most SEC_MAX_REQUESTS_PER_SECOND slots, no more than that many
+    requests can start in any one-second window.
     """
-    Query the SEC submissions API for header details for a given CIK.
+    async with sem:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            await asyncio.sleep(max(0.0, 1.0 - (time.monotonic() - start)))
+
+async def _fetch_submission(session: aiohttp.ClientSession, sem: asyncio.Semaphore, cik: int) -> dict:
+    """
+    Asynchronously query the SEC submissions API for a given CIK.
+
+    Callers have already checked the disk cache for a fresh entry; a stale one is
+    revalidated with If-Modified-Since. HTTP 429 responses are retried with
+    exponential backoff.
 
     Args:
+        session (ClientSession): Shared aiohttp session.
+        sem (Semaphore): Semaphore bounding concurrent requests.
         cik (int): The company's CIK.
 
     Returns:
         Dictionary with submission data if available, else an empty dict.
     """
+    # Only revalidate a stale entry that still parses; a 304 for a corrupt file would leave nothing to return.
+    stale = _read_cached_submission(cik, max_age=None)
+    request_headers = dict(HEADERS)
+    cache_path = _submission_cache_path(cik)
+    if stale is not None:
+        request_headers["If-Modified-Since"] = formatdate(os.path.getmtime(cache_path), usegmt=True)
+
     cik_str = str(cik).zfill(10)
     url = f"https://data.sec.gov/submissions/CIK{cik_str}.json"
-    resp = requests.get(url, headers=HEADERS)
-    if resp.status_code == 200:
-        return resp.json()
-    else:
-        print(f"Warning: Unable to fetch submission data for CIK {cik}")
-        return {}
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with _rate_limited(sem):
+                async with session.get(url, headers=request_headers) as resp:
+                    if resp.status == 200:
+                        body = await resp.text()
+                        _write_cached_submission(cik, body)
+                        return json.loads(body)
+                    status = resp.status
+        except aiohttp.ClientError as e:
+            print(f"Error fetching submission data for CIK {cik}: {e}")
+            break
+        if status == 304 and stale is not None:
+            os.utime(cache_path)
+            return stale
+        if status != 429:
+            break
+        await asyncio.sleep(2 ** attempt)
+    print(f"Warning: Unable to fetch submission data for CIK {cik}")
+    return {}
 
-def enrich_header_data(filings_df: pd.DataFrame) -> pd.DataFrame:
+def load_bulk_submissions(ciks: Set[int]) -> Dict[int, dict]:
+    """
+    Load submission data for many CIKs from SEC's bulk submissions archive.
+
+    The archive is streamed to a temporary file, and only the members for the
+    requested CIKs are read. Each one is also written to the disk cache.
+
+    Args:
+        ciks (set): CIKs to load.
+
+    Returns:
+        Dictionary mapping CIK to submission data, for CIKs found in the archive.
+    """
+    submissions = {}
+    print(f"Downloading bulk submissions archive for {len(ciks)} CIKs ...")
+    with SESSION.get(BULK_SUBMISSIONS_URL, headers=HEADERS, stream=True, timeout=REQUEST_TIMEOUT) as resp:
+        if resp.status_code != 200:
+            print(f"Warning: Unable to download bulk submissions archive (status {resp.status_code})")
+            return submissions
+        with tempfile.TemporaryFile() as tmp:
+            for chunk in resp.iter_content(chunk_size=1 << 20):
+                tmp.write(chunk)
+            with zipfile.ZipFile(tmp) as zf:
+                members = set(zf.namelist())
+                for cik in ciks:
+                    name = f"CIK{str(cik).zfill(10)}.json"
+                    if name not in members:
+                        continue
+                    # A bad member is skipped so the per-CIK endpoint can fetch it instead.
+                    try:
+                        body = zf.read(name).decode("utf-8")
+                        data = json.loads(body)
+                    except (zipfile.BadZipFile, EOFError, zlib.error, ValueError) as e:
+                        print(f"Warning: Skipping unreadable bulk entry {name}: {e}")
+                        continue
+                    _write_cached_submission(cik, body)
+                    submissions[cik] = data
+    return submissions
+
+async def _fetch_submissions(session: aiohttp.ClientSession, ciks: list) -> list:
+    """
+    Fetch submission data for all CIKs, preserving input order.
+
+    Fresh disk-cache entries are used as-is. If more than BULK_SUBMISSIONS_THRESHOLD
+    CIKs are not cached, they are loaded from the bulk archive in one download;
+    anything still missing (including everything, if the bulk load fails) is
+    fetched concurrently from the per-CIK endpoint.
+    """
+    results = {cik: _read_cached_submission(cik) for cik in set(ciks)}
+    missing = {cik for cik, data in results.items() if data is None}
+    if len(missing) > BULK_SUBMISSIONS_THRESHOLD:
+        try:
+            results.update(await asyncio.to_thread(load_bulk_submissions, missing))
+        except (requests.RequestException, zipfile.BadZipFile, OSError) as e:
+            print(f"Warning: Bulk submissions load failed, fetching per CIK instead: {e}")
+        missing = {cik for cik, data in results.items() if data is None}
+
+    sem = asyncio.Semaphore(SEC_MAX_REQUESTS_PER_SECOND)
+    missing = list(missing)
+    fetched = await asyncio.gather(*[_fetch_submission(session, sem, cik) for cik in missing])
+    results.update(zip(missing, fetched))
+    return [results[cik] for cik in ciks]
+
+async def enrich_header_data(session: aiohttp.ClientSession, filings_df: pd.DataFrame) -> pd.DataFrame:
     """
     Enrich the filings DataFrame with additional header information via the SEC Submissions Endpoint.
 
     Args:
+        session (ClientSession): Shared aiohttp session.
         filings_df (DataFrame): The initial filings DataFrame.
 
     Returns:
         DataFrame enriched with header details.
     """
+    submissions = await _fetch_submissions(session, filings_df["cik"].tolist())
     header_data = []
-    for _, row in filings_df.iterrows():
-        submission = get_submission_data(row["cik"])
+    rows = filings_df[["cik", "companyName", "formType", "filedAt", "accessionNumber", "fileLink"]].itertuples(
+        index=False, name=None
+    )
+    for (cik, company, form, filed, acc, link), submission in zip(rows, submissions):
         state = submission.get("stateOfIncorporation", "")
         if not state:
             state = submission.get("businessAddress", {}).get("state", "")
             if not state:
                 state = submission.get("mailingAddress", {}).get("state", "")
         header_data.append({
-            "CIK": row["cik"],
-            "CompanyName": submission.get("name", row["companyName"]),
-            "FormType": row["formType"],
-            "FilingDate": row["filedAt"],
+            "CIK": cik,
+            "CompanyName": submission.get("name", company),
+            "FormType": form,
+            "FilingDate": filed,
             "SIC": submission.get("sic", ""),
             "State": state,
             "City": submission.get("businessAddress", {}).get("city", ""),
             "Zip": submission.get("businessAddress", {}).get("zip", ""),
-            "AccessionNumber": row["accessionNumber"],
-            "FileLink": row["fileLink"]
+            "AccessionNumber": acc,
+            "FileLink": link
         })
     headers_df = pd.DataFrame(header_data)
     headers_df["FilingDate"] = pd.to_datetime(headers_df["FilingDate"])
+    # Few distinct values each; categories cut memory and speed up the state groupbys.
+    headers_df = headers_df.astype({"State": "category", "SIC": "category"})
     print(headers_df.info())
     print(headers_df.head(10))
     return headers_df
@@ -166,33 +329,75 @@ def create_state_heatmap(df: pd.DataFrame, title: str) -> None:
     )
     fig.show()
 
-def get_filing_text(file_link: str) -> str:
+def parse_10k(html: str) -> str:
     """
-    Download and parse the filing details page, extracting the primary 10-K document text.
+    Parse a filing details page, extracting the primary 10-K document text.
+
+    Uses selectolax (lexbor) for speed and falls back to BeautifulSoup if it fails.
 
     Args:
+        html (str): Decoded filing page content.
+
+    Returns:
+        The text content of the 10-K document, or of the whole page if no 10-K document is found.
+    """
+    try:
+        tree = LexborHTMLParser(html)
+        tree.strip_tags(["script", "style"])
+        for doc in tree.css("document"):
+            type_tag = doc.css_first("type")
+            if type_tag is not None and type_tag.text().strip() == "10-K":
+                return doc.text(separator=" ", strip=True)
+        return tree.root.text(separator=" ", strip=True) if tree.root is not None else ""
+    except Exception as e:
+        print(f"selectolax failed to parse filing, falling back to BeautifulSoup: {e}")
+        return _parse_10k_bs4(html)
+
+def _parse_10k_bs4(html: str) -> str:
+    """BeautifulSoup equivalent of parse_10k."""
+    soup = BeautifulSoup(html, "lxml")
+    docs = soup.find_all("document")
+    for doc in docs:
+        type_tag = doc.find("type")
+        if type_tag and type_tag.get_text().strip() == "10-K":
+            return doc.get_text(separator=" ", strip=True)
+    return soup.get_text(separator=" ", strip=True)
+
+async def get_filing_text(session: aiohttp.ClientSession, sem: asyncio.Semaphore, file_link: str) -> str:
+    """
+    Download the filing details page and extract the primary 10-K document text.
+
+    The body is decoded here because lexbor reads raw bytes as UTF-8 and ignores
+    <meta charset>; like requests' .text, the response charset is used with a
+    latin-1 fallback. Parsing runs in a worker thread so it does not block other
+    downloads.
+
+    Args:
+        session (ClientSession): Shared aiohttp session.
+        sem (Semaphore): Semaphore bounding concurrent downloads.
         file_link (str): URL of the filing details page.
 
     Returns:
         The text content of the 10-K document.
     """
     try:
-        response = requests.get(file_link, headers=HEADERS)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "lxml")
-            docs = soup.find_all("document")
-            for doc in docs:
-                type_tag = doc.find("type")
-                if type_tag and type_tag.get_text().strip() == "10-K":
-                    return doc.get_text(separator=" ", strip=True)
-            return soup.get_text(separator=" ", strip=True)
-        else:
-            print(f"Error {response.status_code} fetching {file_link}")
-            return ""
+        async with _rate_limited(sem), session.get(file_link, headers=HEADERS) as resp:
+            if resp.status != 200:
+                print(f"Error {resp.status} fetching {file_link}")
+                return ""
+            # The raw bytes are dropped once decoded, so only one copy of the body is kept.
+            html = (await resp.read()).decode(resp.charset or "latin-1", errors="replace")
+        return await asyncio.to_thread(parse_10k, html)
     except Exception as e:
         print(f"Error fetching filing at {file_link}: {e}")
         return ""
 
+# Scanning patterns use RE2, which runs in time linear in the text length. RE2's \s is
+# ASCII-only, so [\s\pZ] is used where Python's \s would also match e.g. non-breaking spaces.
+_ITEM1_RE = re2.compile(
+    r'(?is)(ITEM[\s\pZ]+1[\s\pZ]*\.?[\s\pZ]*BUSINESS.*?)ITEM[\s\pZ]+1A[\s\pZ]*\.?[\s\pZ]*RISK[\s\pZ]+FACTORS'
+)
+
 def extract_item1_business(text: str) -> str:
     """
     Extract the 'Item 1. Business' section from a filing text.
@@ -203,9 +408,17 @@ def extract_item1_business(text: str) -> str:
     Returns:
         The extracted 'Item 1. Business' section or an empty string if not found.
     """
-    pattern = r'ITEM\s+1\s*\.?\s*BUSINESS.*?(?=ITEM\s+1A\s*\.?\s*RISK\s+FACTORS)'
-    matches = re.findall(pattern, text, flags=re.IGNORECASE | re.DOTALL)
-    return matches[0] if matches else ""
+    # Cheap substring pre-check: skip the regex when words it requires are absent.
+    upper = text.upper()
+    if "BUSINESS" not in upper or "1A" not in upper or "RISK" not in upper:
+        return ""
+    match = _ITEM1_RE.search(text)
+    return match.group(1) if match else ""
+
+_AI_RE = re2.compile(r'(?i)artificial intelligence')
+# A sentence runs up to the first [.!?] followed by whitespace, or to the end of the text.
+# This is the same boundary rule as sentence_filter.pyx.
+_SENTENCE_RE = re2.compile(r'(?s)(.*?[.!?])[\s\pZ]+|(.+)')
 
 def extract_ai_sentences(text: str) -> list:
     """
@@ -217,26 +430,40 @@ def extract_ai_sentences(text: str) -> list:
     Returns:
         List of sentences containing the term 'Artificial Intelligence'.
     """
-    pattern_ai = re.compile(r'artificial intelligence', flags=re.IGNORECASE)
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s for s in sentences if pattern_ai.search(s)]
-
-def process_filings_documents(filings_df: pd.DataFrame) -> dict:
+    if "artificial intelligence" not in text.lower():
+        return []
+    sentences = (m.group(1) or m.group(2) for m in _SENTENCE_RE.finditer(text))
+    return [s for s in sentences if _AI_RE.search(s)]
+
+# Prefer the Cython sentence filter (sentence_filter.pyx, compiled on first import by pyximport),
+# which walks the text once without building a list of every sentence. Fall back to the
+# RE2 implementation above if Cython or a C compiler is unavailable.
+try:
+    import pyximport
+    pyximport.install(language_level=3)
+    from sentence_filter import find_ai_sentences
+except ImportError:
+    find_ai_sentences = extract_ai_sentences
+
+async def process_filings_documents(session: aiohttp.ClientSession, filings_df: pd.DataFrame) -> dict:
     """
     Download, clean, and process filing documents for each accession number.
 
     Args:
+        session (ClientSession): Shared aiohttp session.
         filings_df (DataFrame): DataFrame containing filings information.
 
     Returns:
         Dictionary mapping accession numbers to their filing text.
     """
-    clean_docs = {}
-    for idx, row in filings_df.iterrows():
-        print(f"Processing filing {idx+1} of {len(filings_df)}")
-        filing_text = get_filing_text(row["fileLink"])
-        clean_docs[row["accessionNumber"]] = filing_text
-    return clean_docs
+    sem = asyncio.Semaphore(DOCUMENT_CONCURRENCY)
+    print(f"Processing {len(filings_df)} filings ...")
+    async with asyncio.TaskGroup() as tg:
+        tasks = {
+            acc: tg.create_task(get_filing_text(session, sem, link))
+            for acc, link in zip(filings_df["accessionNumber"].values, filings_df["fileLink"].values)
+        }
+    return {acc: task.result() for acc, task in tasks.items()}
 
 def analyze_filings(filings_df: pd.DataFrame, headers_df: pd.DataFrame, clean_docs: dict) -> pd.DataFrame:
     """
@@ -259,24 +486,26 @@ def analyze_filings(filings_df: pd.DataFrame, headers_df: pd.DataFrame, clean_do
     else:
         print("No filings processed for Item 1 extraction.")
     
-    # Extract sentences containing "Artificial Intelligence".
-    ai_sentences = {acc: extract_ai_sentences(text) for acc, text in clean_docs.items()}
-    if any(len(sents) > 0 for sents in ai_sentences.values()):
+    # Flag filings mentioning "Artificial Intelligence" with one vectorized substring scan.
+    mentions_ai = pd.Series(clean_docs, dtype=object).str.contains(
+        "artificial intelligence", case=False, regex=False
+    )
+    
+    # Extract sentences containing "Artificial Intelligence", only for flagged filings.
+    ai_sentences = {acc: find_ai_sentences(clean_docs[acc]) for acc in mentions_ai[mentions_ai].index}
+    if ai_sentences:
         for acc, sentences in ai_sentences.items():
-            if sentences:
-                print(f"\n=== Accession Number: {acc} ===")
-                for sentence in sentences:
-                    print("•", sentence)
+            print(f"\n=== Accession Number: {acc} ===")
+            for sentence in sentences:
+                print("•", sentence)
     else:
         print("No documents mention 'Artificial Intelligence' by that exact phrase.")
     
-    # Add AI_Flag to headers_df: 1 if AI sentences found, else 0.
-    headers_df["AI_Flag"] = headers_df["AccessionNumber"].apply(
-        lambda acc: 1 if len(ai_sentences.get(acc, [])) > 0 else 0
-    )
+    # Add AI_Flag to headers_df: 1 if the filing mentions AI, else 0.
+    headers_df["AI_Flag"] = headers_df["AccessionNumber"].map(mentions_ai.astype("int8")).fillna(0).astype("int8")
     return headers_df
 
-def main():
+async def main():
     # Set up working directory.
     set_working_directory(WORKING_DIR)
     
@@ -284,23 +513,25 @@ def main():
     query_api = QueryApi(api_key=API_KEY)
     filings_df = query_filings(query_api, QUERY_STRING, DESIRED_COUNT, PAGE_SIZE)
     
-    # --- PART 1(b): Enrich Header Information --- #
-    headers_df = enrich_header_data(filings_df)
-    
-    # --- PART 1(c): Geographic Visualization – State-Level Heatmap --- #
-    state_counts = headers_df[headers_df["State"] != ""].groupby("State").size().reset_index(name="Count")
-    print("State counts:")
-    print(state_counts)
-    create_state_heatmap(state_counts, "Number of Firms by State (Headquarters)")
-    
-    # --- PART 2: Download, Clean, and Process Filing Documents --- #
-    clean_docs = process_filings_documents(filings_df)
+    # One session for all SEC downloads so connections are reused.
+    async with aiohttp.ClientSession() as session:
+        # --- PART 1(b): Enrich Header Information --- #
+        headers_df = await enrich_header_data(session, filings_df)
+        
+        # --- PART 1(c): Geographic Visualization – State-Level Heatmap --- #
+        state_counts = headers_df[headers_df["State"] != ""].groupby("State", observed=True).size().reset_index(name="Count")
+        print("State counts:")
+        print(state_counts)
+        create_state_heatmap(state_counts, "Number of Firms by State (Headquarters)")
+        
+        # --- PART 2: Download, Clean, and Process Filing Documents --- #
+        clean_docs = await process_filings_documents(session, filings_df)
     
     # --- PART 2(b) & 2(c): Extract 'Item 1. Business' and AI-related Sentences --- #
     headers_df = analyze_filings(filings_df, headers_df, clean_docs)
     
     # Aggregate by state: total filings and filings mentioning AI.
-    state_agg = headers_df[headers_df["State"] != ""].groupby("State").agg(
+    state_agg = headers_df[headers_df["State"] != ""].groupby("State", observed=True).agg(
         Total_Filings=("AccessionNumber", "count"),
         AI_Filings=("AI_Flag", "sum")
     ).reset_index()
@@ -308,4 +539,4 @@ def main():
     create_state_heatmap(state_agg, "Number of Filings and Filings Mentioning 'Artificial Intelligence'")
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
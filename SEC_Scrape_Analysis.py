@@ -8,16 +8,27 @@ Author: Ryan Loveless
 Date: 3/5/2025
 """
 
+import io
 import os
-import re
-import shutil
-import requests
+import csv
+import re2
+import asyncio
+import zipfile
+import aiohttp
+import zstandard
 import pandas as pd
 import matplotlib.pyplot as plt
-from typing import List, Optional
+from lxml import etree
+from typing import List, Optional, Set
 
 # === Configuration Constants === #
 from constants import BASE_FILINGS_URL, SEC_BASE_URL, USER_AGENT, WORKING_DIR
+from sec_session import REQUEST_TIMEOUT, make_session
+INDEX_CONCURRENCY = 5  # concurrent index downloads, well under SEC's 10 req/s limit
+INDEX_CHUNKSIZE = 50000  # index rows parsed per chunk when filtering by CIK
+ZSTD_LEVEL = 3
+
+SESSION = make_session()  # pooled session for synchronous requests
 
 # === Utility Functions === #
 def ensure_working_directory(path: str) -> None:
@@ -26,63 +37,118 @@ def ensure_working_directory(path: str) -> None:
         os.makedirs(path)
     os.chdir(path)
 
-def download_and_extract_index(year: int, quarter: int, base_url: str, user_agent: str) -> Optional[pd.DataFrame]:
+def parse_index_file(content: bytes, cik_filter: Optional[Set[int]] = None) -> pd.DataFrame:
+    """
+    Parse a zipped SEC master index (master.zip) held in memory.
+    
+    If cik_filter is given, the index is parsed in chunks and only rows for those
+    CIKs are kept, so the full index is never held as one DataFrame.
+    
+    Returns:
+        DataFrame of the parsed index.
+    """
+    # Skip header lines and parse the rest with the pandas C parser.
+    with zipfile.ZipFile(io.BytesIO(content)) as zf, zf.open('master.idx') as fh:
+        chunks = pd.read_csv(
+            fh,
+            sep='|',
+            skiprows=11,
+            header=None,
+            names=['CIK', 'CompanyName', 'FormType', 'DateFiled', 'FileName'],
+            dtype={'CIK': 'int32', 'CompanyName': str, 'FormType': str, 'DateFiled': str, 'FileName': str},
+            encoding='latin1',
+            quoting=csv.QUOTE_NONE,
+            engine='c',
+            chunksize=INDEX_CHUNKSIZE
+        )
+        if cik_filter is not None:
+            chunks = (chunk[chunk['CIK'].isin(cik_filter)] for chunk in chunks)
+        # CIK is already int32; FormType has few distinct values, so store it as a category.
+        return pd.concat(chunks, ignore_index=True).astype({'FormType': 'category'})
+
+async def download_and_extract_index(session: aiohttp.ClientSession, sem: asyncio.Semaphore, year: int, quarter: int,
+                                     base_url: str, user_agent: str,
+                                     cik_filter: Optional[Set[int]] = None) -> Optional[pd.DataFrame]:
     """
     Download and extract SEC index file for a given year and quarter.
     
+    The archive is read in memory, so nothing is written to disk. Parsing runs in a
+    worker thread so other downloads can proceed. If cik_filter is given, only rows
+    for those CIKs are returned.
+    
     Returns:
         DataFrame of the parsed index or None if download fails.
     """
-    zip_filename = f"master{year}qtr{quarter}.zip"
-    txt_filename = f"master{year}qtr{quarter}.txt"
     url = f"{base_url}{year}/QTR{quarter}/master.zip"
     print(f"Processing {year} Q{quarter}...")
     
-    response = requests.get(url, headers={"User-Agent": user_agent})
-    if response.status_code != 200:
-        print(f"Failed to download data for {year} Q{quarter}")
-        return None
-
-    with open(zip_filename, 'wb') as f:
-        f.write(response.content)
+    async with sem, session.get(url, headers={"User-Agent": user_agent}) as response:
+        if response.status != 200:
+            print(f"Failed to download data for {year} Q{quarter}")
+            return None
+        content = await response.read()
+    return await asyncio.to_thread(parse_index_file, content, cik_filter)
+
+async def download_indexes(quarters: List[tuple], base_url: str, user_agent: str,
+                           cik_filter: Optional[Set[int]] = None) -> List[pd.DataFrame]:
+    """
+    Download and extract the SEC index files for several quarters concurrently.
     
-    shutil.unpack_archive(zip_filename)
-    os.rename("master.idx", txt_filename)
+    If cik_filter is given, only rows for those CIKs are kept.
     
-    # Skip header lines and parse the rest into a DataFrame.
-    with open(txt_filename, 'r', encoding='latin1') as f:
-        lines = f.readlines()[11:]
-    data = [line.strip().split('|') for line in lines if line.strip()]
-    return pd.DataFrame(data, columns=['CIK', 'CompanyName', 'FormType', 'DateFiled', 'FileName'])
+    Returns:
+        List of parsed index DataFrames, skipping quarters that failed to download.
+    """
+    sem = asyncio.Semaphore(INDEX_CONCURRENCY)
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*[
+            download_and_extract_index(session, sem, year, quarter, base_url, user_agent, cik_filter)
+            for year, quarter in quarters
+        ])
+    return [df for df in results if df is not None]
 
 def download_filing(file_url: str, local_path: str, user_agent: str) -> Optional[str]:
     """
-    Download a filing and save it locally.
+    Download a filing and save it locally as Zstandard-compressed text.
+    
+    The filing is stored at local_path + '.zst'. If that file already exists it is
+    read back instead of downloading the filing again; a corrupt file is deleted and
+    the filing is downloaded again.
     
     Returns:
         The filing text if download succeeds, or None.
     """
-    response = requests.get(file_url, headers={"User-Agent": user_agent})
+    cache_path = local_path + ".zst"
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            data = f.read()
+        try:
+            return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+        except zstandard.ZstdError:
+            print(f"Corrupt cached filing {cache_path}, downloading again")
+            os.remove(cache_path)
+
+    response = SESSION.get(file_url, headers={"User-Agent": user_agent}, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
-        with open(local_path, "w", encoding="utf-8") as f:
-            f.write(response.text)
+        # Write to a temporary file and rename, so an interrupted run never leaves a truncated cache entry.
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(response.text.encode("utf-8")))
+        os.replace(tmp_path, cache_path)
         return response.text
     else:
         print(f"Failed to download filing from {file_url}")
         return None
 
 # === Text Extraction Functions === #
-def extract_first_topic(text: str) -> str:
-    """
-    Extract the first event topic from the 'ITEM INFORMATION:' header.
-    
-    If no topic is found, returns "Unknown".
-    """
-    pattern = re.compile(r'ITEM INFORMATION:\s*(.+)', re.IGNORECASE)
-    match = pattern.search(text)
-    if match:
-        return match.group(1).splitlines()[0].strip()
-    return "Unknown"
+# Patterns are compiled with RE2 (linear-time matching); flags are given inline.
+_ALL_TOPICS_RE = re2.compile(r'(?is)ITEM INFORMATION:\s*(.*?)(?:\bFILED AS OF DATE:|\z)')
+_FILED_DATE_RE = re2.compile(r'(?i)\bFILED AS OF DATE:\s*(\d{8})\b')
+_DELISTING_RE = re2.compile(r'(?i)\bdelisting\b')
+# These two are applied to every 8-K at once through pandas string methods, which
+# compile them with the stdlib re engine, so they are kept as pattern strings.
+_FIRST_TOPIC_PATTERN = r'(?i)ITEM INFORMATION:\s*(.+)'
+_BANKRUPTCY_PATTERN = r'(?i)\b(?:bankruptcy|bankruptcies)\b'
 
 def extract_all_topics(text: str) -> List[str]:
     """
@@ -91,8 +157,7 @@ def extract_all_topics(text: str) -> List[str]:
     Returns:
         A list of topics extracted from the text.
     """
-    pattern = re.compile(r'ITEM INFORMATION:\s*(.*?)(?=\bFILED AS OF DATE:|\Z)', re.IGNORECASE | re.DOTALL)
-    match = pattern.search(text)
+    match = _ALL_TOPICS_RE.search(text)
     if match:
         topics_block = match.group(1)
         return [line.strip() for line in topics_block.splitlines() if line.strip()]
@@ -105,21 +170,49 @@ def extract_filed_date(text: str) -> Optional[str]:
     Returns:
         The date string in 8-digit format if found, otherwise None.
     """
-    pattern = re.compile(r'\bFILED AS OF DATE:\s*(\d{8})\b', re.IGNORECASE)
-    match = pattern.search(text)
+    match = _FILED_DATE_RE.search(text)
     if match:
         return match.group(1)
     return None
 
-def count_bankruptcy_terms(text: str) -> int:
+FORM4_FIELDS = ['IsOfficer', 'OfficerTitle', 'TransactionType', 'TransactionDate']
+
+def parse_form4(text: str) -> dict:
     """
-    Count occurrences of 'bankruptcy' or 'bankruptcies' in the text.
+    Parse the <ownershipDocument> XML block of a Form 4 filing once and read its fields.
     
     Returns:
-        The count as an integer.
+        Dictionary with 'IsOfficer' ("1"/"0"), 'OfficerTitle' (cleaned, upper case),
+        'TransactionType' ("A"/"D") and 'TransactionDate' (YYYYMMDD). Missing fields
+        are None, except OfficerTitle which defaults to "UNKNOWN".
     """
-    pattern = re.compile(r'\b(bankruptcy|bankruptcies)\b', re.IGNORECASE)
-    return len(pattern.findall(text))
+    fields = {'IsOfficer': None, 'OfficerTitle': "UNKNOWN", 'TransactionType': None, 'TransactionDate': None}
+    end_tag = '</ownershipDocument>'
+    start = text.find('<ownershipDocument')
+    end = text.rfind(end_tag)
+    if start == -1 or end == -1:
+        return fields
+    try:
+        root = etree.fromstring(text[start:end + len(end_tag)])
+    except etree.XMLSyntaxError:
+        return fields
+
+    is_officer = root.findtext('.//isOfficer')
+    if is_officer:
+        # The schema allows both 1/0 and true/false.
+        is_officer = is_officer.strip().lower()
+        fields['IsOfficer'] = {'true': "1", 'false': "0"}.get(is_officer, is_officer)
+    title = root.findtext('.//officerTitle')
+    if title is not None:
+        title_clean = title.replace('&', '').replace(',', '')
+        fields['OfficerTitle'] = " ".join(title_clean.split()).upper()
+    transaction_type = root.findtext('.//transactionAcquiredDisposedCode/value')
+    if transaction_type:
+        fields['TransactionType'] = transaction_type.strip().upper()
+    transaction_date = root.findtext('.//transactionDate/value')
+    if transaction_date:
+        fields['TransactionDate'] = transaction_date.strip().replace('-', '')
+    return fields
 
 # === Main Analysis Functions === #
 def process_sec_filings():
@@ -129,21 +222,15 @@ def process_sec_filings():
         (2022, 4), (2023, 1), (2023, 2), (2023, 3),
         (2023, 4), (2024, 1), (2024, 2), (2024, 3)
     ]
-    dataframes = []
-    for year, quarter in sec_quarters:
-        df = download_and_extract_index(year, quarter, SEC_BASE_URL, USER_AGENT)
-        if df is not None:
-            dataframes.append(df)
+    # Only rows for the two banks are kept while parsing the indexes.
+    bank_ciks = {719739, 834285}
+    dataframes = asyncio.run(download_indexes(sec_quarters, SEC_BASE_URL, USER_AGENT, cik_filter=bank_ciks))
     if not dataframes:
         print("No SEC data available.")
         return
-    sec_data = pd.concat(dataframes, ignore_index=True)
-    sec_data['CIK'] = sec_data['CIK'].astype(int)
-
-    # Filter for the two banks.
-    bank_ciks = [719739, 834285]
-    bank_data = sec_data[sec_data['CIK'].isin(bank_ciks)]
-    form_frequencies = bank_data.groupby(['CIK', 'FormType']).size().reset_index(name='Frequency')
+    # Categories differ between quarters, so concat falls back to object; re-categorize.
+    bank_data = pd.concat(dataframes, ignore_index=True).astype({'FormType': 'category'})
+    form_frequencies = bank_data.groupby(['CIK', 'FormType'], observed=True).size().reset_index(name='Frequency')
     print("SEC Form Frequencies for the two banks (2022Q4 to 2024Q3):")
     print(form_frequencies)
 
@@ -151,17 +238,20 @@ def process_sec_filings():
     bank_8k = bank_data[bank_data['FormType'] == '8-K'].copy()
     os.makedirs("8K_filings", exist_ok=True)
     filing_texts = {}
-    for idx, row in bank_8k.iterrows():
-        file_url = BASE_FILINGS_URL + row['FileName']
-        local_filename = os.path.join("8K_filings", f"{row['CIK']}_{row['DateFiled']}_{idx}.txt")
-        print(f"Downloading 8-K filing for CIK {row['CIK']}...")
+    for row in bank_8k.itertuples():
+        idx = row.Index
+        file_url = BASE_FILINGS_URL + row.FileName
+        local_filename = os.path.join("8K_filings", f"{row.CIK}_{row.DateFiled}_{os.path.basename(row.FileName)}")
+        print(f"Downloading 8-K filing for CIK {row.CIK}...")
         text = download_filing(file_url, local_filename, USER_AGENT)
         if text:
             filing_texts[idx] = text
 
-    # Extract and analyze first topics.
-    bank_8k['FirstTopic'] = bank_8k.index.map(lambda idx: extract_first_topic(filing_texts.get(idx, "")))
-    freq_first_topics = bank_8k.groupby(['CIK', 'FirstTopic']).size().reset_index(name='Frequency')
+    # Extract and analyze first topics with one pandas string method over every filing.
+    texts = pd.Series(filing_texts, dtype=object)
+    first_topics = texts.str.extract(_FIRST_TOPIC_PATTERN, expand=False).str.strip().fillna("Unknown")
+    bank_8k['FirstTopic'] = bank_8k.index.map(first_topics).fillna("Unknown").astype('category')
+    freq_first_topics = bank_8k.groupby(['CIK', 'FirstTopic'], observed=True).size().reset_index(name='Frequency')
     freq_first_topics = freq_first_topics.sort_values(by='Frequency', ascending=False)
     print("\nFrequencies of 8-K topics (first topic extracted):")
     print(freq_first_topics)
@@ -169,8 +259,8 @@ def process_sec_filings():
     # Delisting analysis based on first topic.
     delisting_filing_dates = {}
     for idx, text in filing_texts.items():
-        topic = extract_first_topic(text)
-        if re.search(r'\bdelisting\b', topic, re.IGNORECASE):
+        topic = first_topics[idx]
+        if _DELISTING_RE.search(topic):
             filed_date = extract_filed_date(text)
             if filed_date:
                 cik = bank_8k.loc[idx, 'CIK']
@@ -183,7 +273,7 @@ def process_sec_filings():
     delisting_filing_dates_all = {}
     for idx, text in filing_texts.items():
         topics = extract_all_topics(text)
-        if any(re.search(r'\bdelisting\b', t, re.IGNORECASE) for t in topics):
+        if any(_DELISTING_RE.search(t) for t in topics):
             filed_date = extract_filed_date(text)
             if filed_date:
                 cik = bank_8k.loc[idx, 'CIK']
@@ -193,8 +283,8 @@ def process_sec_filings():
         print(f"CIK {cik}: {dates}")
 
     # Bankruptcy count analysis.
-    bankruptcy_counts = {idx: count_bankruptcy_terms(text) for idx, text in filing_texts.items()}
-    bank_8k['BankruptcyCount'] = bank_8k.index.map(lambda idx: bankruptcy_counts.get(idx, 0))
+    bankruptcy_counts = texts.str.count(_BANKRUPTCY_PATTERN)
+    bank_8k['BankruptcyCount'] = bank_8k.index.map(bankruptcy_counts).fillna(0).astype(int)
     firm_bankruptcy_counts = bank_8k.groupby('CIK')['BankruptcyCount'].sum().reset_index()
     print("\nCount of 'bankruptcy' or 'bankruptcies' in each firm's entire 8-K documents:")
     print(firm_bankruptcy_counts)
@@ -206,16 +296,11 @@ def process_amc_filings():
         (2020, 3), (2020, 4), (2021, 1), (2021, 2),
         (2021, 3), (2021, 4), (2022, 1), (2022, 2)
     ]
-    amc_dataframes = []
-    for year, quarter in amc_quarters:
-        df = download_and_extract_index(year, quarter, SEC_BASE_URL, USER_AGENT)
-        if df is not None:
-            amc_dataframes.append(df)
+    amc_dataframes = asyncio.run(download_indexes(amc_quarters, SEC_BASE_URL, USER_AGENT, cik_filter={1411579}))
     if not amc_dataframes:
         print("No AMC data available.")
         return
-    amc_index_data = pd.concat(amc_dataframes, ignore_index=True)
-    amc_index_data['CIK'] = amc_index_data['CIK'].astype(int)
+    amc_index_data = pd.concat(amc_dataframes, ignore_index=True).astype({'FormType': 'category'})
 
     # Filter for AMC Entertainment Form 4 filings.
     amc_data = amc_index_data[(amc_index_data['CIK'] == 1411579) &
@@ -225,65 +310,38 @@ def process_amc_filings():
 
     os.makedirs("Form4_filings", exist_ok=True)
     amc_filings_texts = {}
-    for idx, row in amc_data.iterrows():
-        file_url = BASE_FILINGS_URL + row['FileName']
-        local_filename = os.path.join("Form4_filings", f"{row['CIK']}_{row['DateFiled']}_{idx}.txt")
+    for row in amc_data.itertuples():
+        idx = row.Index
+        file_url = BASE_FILINGS_URL + row.FileName
+        local_filename = os.path.join("Form4_filings", f"{row.CIK}_{row.DateFiled}_{os.path.basename(row.FileName)}")
         print(f"Downloading AMC Form 4 filing...")
         text = download_filing(file_url, local_filename, USER_AGENT)
         if text:
             amc_filings_texts[idx] = text
 
-    # --- Task B1: Extract isOfficer indicator --- #
-    def extract_is_officer(text: str) -> Optional[str]:
-        pattern = re.compile(r'<\s*isOfficer\s*>\s*(\d+)\s*<\s*/\s*isOfficer\s*>', re.IGNORECASE)
-        match = pattern.search(text)
-        return match.group(1).strip() if match else None
+    # Parse each filing's ownership XML once and join all Form 4 fields in one step.
+    form4_fields = {idx: parse_form4(text) for idx, text in amc_filings_texts.items()}
+    amc_data = amc_data.join(pd.DataFrame.from_dict(form4_fields, orient='index', columns=FORM4_FIELDS))
 
-    amc_data['IsOfficer'] = amc_data.index.map(lambda idx: extract_is_officer(amc_filings_texts.get(idx, "")))
-    officer_filings = amc_data[amc_data['IsOfficer'] == "1"]
+    # --- Task B1: Extract isOfficer indicator --- #
+    officer_filings = amc_data[amc_data['IsOfficer'] == "1"].astype(
+        {'OfficerTitle': 'category', 'TransactionType': 'category'}
+    )
     print(f"\nNumber of Form 4 filings filed by an officer: {len(officer_filings)}")
 
     # --- Task B2: Extract and clean officer titles --- #
-    def extract_officer_title(text: str) -> str:
-        pattern = re.compile(r'<\s*officerTitle\s*>\s*(.*?)\s*<\s*/\s*officerTitle\s*>', re.IGNORECASE | re.DOTALL)
-        match = pattern.search(text)
-        if match:
-            title = match.group(1)
-            title_clean = title.replace('&amp;', '').replace(',', '')
-            return " ".join(title_clean.split()).upper()
-        return "UNKNOWN"
-
-    officer_filings.loc[:, 'OfficerTitle'] = officer_filings.index.map(lambda idx: extract_officer_title(amc_filings_texts.get(idx, "")))
     officer_title_freq = officer_filings['OfficerTitle'].value_counts().reset_index()
     officer_title_freq.columns = ['OfficerTitle', 'Frequency']
     print("\nCleaned Officer Titles and their Frequencies:")
     print(officer_title_freq)
 
     # --- Task B3: Extract transaction type code (A or D) --- #
-    def extract_transaction_type(text: str) -> Optional[str]:
-        pattern = re.compile(
-            r'<\s*transactionAcquiredDisposedCode\s*>\s*<\s*value\s*>\s*([AD])\s*<\s*/\s*value\s*>\s*<\s*/\s*transactionAcquiredDisposedCode\s*>',
-            re.IGNORECASE
-        )
-        match = pattern.search(text)
-        return match.group(1).strip().upper() if match else None
-
-    officer_filings.loc[:, 'TransactionType'] = officer_filings.index.map(lambda idx: extract_transaction_type(amc_filings_texts.get(idx, "")))
     transaction_type_counts = officer_filings['TransactionType'].value_counts().reset_index()
     transaction_type_counts.columns = ['TransactionType', 'Frequency']
     print("\nTransaction Type Counts among Officer Filings:")
     print(transaction_type_counts)
 
     # --- Task B4: Extract transaction date --- #
-    def extract_transaction_date(text: str) -> Optional[str]:
-        pattern = re.compile(
-            r'<\s*transactionDate\s*>\s*<\s*value\s*>\s*([\d\-]+)\s*<\s*/\s*value\s*>\s*<\s*/\s*transactionDate\s*>',
-            re.IGNORECASE
-        )
-        match = pattern.search(text)
-        return match.group(1).strip().replace('-', '') if match else None
-
-    officer_filings.loc[:, 'TransactionDate'] = officer_filings.index.map(lambda idx: extract_transaction_date(amc_filings_texts.get(idx, "")))
     print("\nExtracted Transaction Dates from Officer Filings:")
     print(officer_filings[['TransactionDate']])
 
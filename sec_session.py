@@ -0,0 +1,31 @@
+"""
+Shared HTTP session settings for the SEC scripts.
+
+Both analysis scripts build their synchronous requests session here, so the
+connection pool and retry policy stay the same across them.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+REQUEST_TIMEOUT = 12  # seconds
+
+def make_session() -> requests.Session:
+    """
+    Create a requests session for SEC downloads.
+
+    The session keeps connections alive in a pool and retries with backoff on SEC
+    rate limiting (429) and transient server errors. After the last retry the
+    response is returned rather than raised, so callers can check its status code.
+
+    Returns:
+        A configured requests.Session.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=Retry(total=3, status_forcelist=[429, 502, 503, 504], backoff_factor=0.5, raise_on_status=False)
+    ))
+    return session
@@ -0,0 +1,58 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Cython sentence filter for filing text.
+
+Walks a filing once and returns only the sentences that mention
+"artificial intelligence", without building a list of every sentence.
+A sentence ends at '.', '!' or '?' followed by whitespace.
+"""
+
+cdef str _PHRASE = "artificial intelligence"
+
+
+cdef bint _contains_phrase(str text, Py_ssize_t start, Py_ssize_t end):
+    """Case-insensitive search for _PHRASE in text[start:end] without slicing."""
+    cdef Py_ssize_t m = len(_PHRASE)
+    cdef Py_ssize_t i, j
+    cdef Py_UCS4 ch
+    for i in range(start, end - m + 1):
+        for j in range(m):
+            ch = text[i + j]
+            if ch.lower() != <Py_UCS4>_PHRASE[j]:
+                break
+        else:
+            return True
+    return False
+
+
+cpdef list find_ai_sentences(str text):
+    """
+    Extract sentences from text that mention 'Artificial Intelligence'.
+
+    Args:
+        text (str): Filing document text.
+
+    Returns:
+        List of sentences containing the term 'Artificial Intelligence'.
+    """
+    cdef Py_ssize_t n = len(text)
+    cdef Py_ssize_t i = 0, start = 0, end
+    cdef Py_UCS4 ch
+    cdef list sentences = []
+    if "artificial intelligence" not in text.lower():
+        return sentences
+    while i < n:
+        ch = text[i]
+        if (ch == u'.' or ch == u'!' or ch == u'?') and i + 1 < n and (<Py_UCS4>text[i + 1]).isspace():
+            end = i + 1
+            if _contains_phrase(text, start, end):
+                sentences.append(text[start:end])
+            i = end
+            while i < n and (<Py_UCS4>text[i]).isspace():
+                i += 1
+            start = i
+        else:
+            i += 1
+    if start < n and _contains_phrase(text, start, n):
+        sentences.append(text[start:n])
+    return sentences